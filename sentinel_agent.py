@@ -1,15 +1,18 @@
+import json
 import logging
+import sys
+import time
+from functools import lru_cache
 from typing import TypedDict
 from dotenv import load_dotenv
 
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_ollama import ChatOllama
 from langgraph.graph import StateGraph, END
 from langfuse.langchain import CallbackHandler
 
 from sentinel_tools import quarantine_file, write_remediation_report
 
-load_dotenv()
-
 # --- Logging Setup ---
 logging.basicConfig(
     filename='sentinel_debug.log',
@@ -24,38 +27,143 @@ class AgentState(TypedDict):
     file_path: str         # The dangerous file
     threat_type: str       # "AWS Key", "PII", etc.
     analysis: str          # LLM reasoning
-    tool_calls: list       # Tools selected by LLM
+    tool_calls: list       # Tools to execute, in order
+    llm_advice: bool       # Ask the LLM to write the report advice
+    timings: dict          # Per-phase latencies in ms, filled in by the nodes
 
 # --- LLM Setup ---
-llm = ChatOllama(model="qwen3-coder:30b", temperature=0)
+# The client and .env are only touched when something actually needs them, so
+# importing this module (and starting the CLI) stays cheap.
+@lru_cache(maxsize=1)
+def _load_env():
+    load_dotenv()
+
+@lru_cache(maxsize=1)
+def get_llm():
+    _load_env()
+    return ChatOllama(model="qwen3-coder:30b", temperature=0)
+
 tools = [quarantine_file, write_remediation_report]
 tools_map = {t.name: t for t in tools}
-llm_with_tools = llm.bind_tools(tools)
-
-# --- Nodes ---
 
-def analyze_threat(state: AgentState):
-    """Analyze the threat and decide on mitigation steps."""
-    path = state["file_path"]
-    threat = state["threat_type"]
-    logger.info(f"Analyzing threat: {threat} in {path}")
+# --- Remediation Advice ---
+# The mitigation plan is fixed (quarantine, then report), so the report text is
+# the only part that could use the LLM. These canned explanations cover every
+# signature the CLI detects.
+ADVICE_TABLE = {
+    "AWS Access Key": (
+        "An AWS access key was committed in plain text. Anyone who can read the repository "
+        "can use it to call AWS APIs on your account, which commonly ends in cloud bill shock "
+        "from crypto-mining or data exfiltration. Rotate the key in IAM immediately and load "
+        "credentials from the environment or a secrets manager instead."
+    ),
+    "OpenAI Secret Key": (
+        "An OpenAI API key was committed in plain text. Leaked keys are scraped from public "
+        "repositories within minutes and used to run up usage charges on your account. Revoke "
+        "the key in the OpenAI dashboard and read it from an environment variable instead."
+    ),
+    "Private Key": (
+        "A private key was committed to the repository. Anyone with the key can impersonate "
+        "the server or user it belongs to and decrypt traffic protected by it. Treat the key "
+        "as compromised: generate a new key pair and keep private keys out of version control."
+    ),
+    "Mass PII (Emails)": (
+        "The file contains a bulk list of email addresses. Committing personal data to a "
+        "repository spreads it to every clone and its history, which is a GDPR risk: it may "
+        "breach data minimisation rules and require breach notification. Remove the personal "
+        "data or replace it with anonymised fixtures."
+    ),
+}
+# Keys are interned to match the signature names the CLI passes in.
+ADVICE_TABLE = {sys.intern(threat): advice for threat, advice in ADVICE_TABLE.items()}
+DEFAULT_ADVICE = (
+    "Sensitive data was detected in this file. Remove it from the file and from history, "
+    "and rotate any credentials it contains."
+)
 
-    # Prompt triggers the LLM to call BOTH tools: Quarantine first, then Report.
+def generate_llm_advice(threat: str, path: str) -> str:
+    """Ask the LLM for a tailored explanation of the risk."""
     msg = [
-        ("system", "You are a Cyber Security Sentinel. You have detected a security violation in a git repository. "
-                   "You must IMMEDIATELY quarantine the file. "
-                   "Then, you must write a remediation report explaining the specific risks of this threat type. "
+        ("system", "You are a Cyber Security Sentinel. A file in a git repository has been quarantined. "
+                   "Write a short remediation note explaining the specific risks of this threat type. "
                    "For AWS keys, explain the risk of cloud bill shock. "
                    "For PII, explain GDPR risks."),
-        ("human", f"ALERT: Detected {threat} in file {path}. Execute protocol.")
+        ("human", f"Detected {threat} in file {path}.")
     ]
+    return get_llm().invoke(msg).content
+
+# --- Latency ---
+
+def _ms_since(start_ns: int) -> float:
+    return round((time.perf_counter_ns() - start_ns) / 1e6, 3)
+
+class LatencyCallback(BaseCallbackHandler):
+    """Records LLM time-to-first-token and time-per-output-token for one event."""
+
+    def __init__(self):
+        self.start_ns = None
+        self.first_token_ns = None
+        self.timings = {}
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.start_ns = time.perf_counter_ns()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.start_ns = time.perf_counter_ns()
 
-    response = llm_with_tools.invoke(msg)
-    return {"tool_calls": response.tool_calls}
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_ns is None:
+            self.first_token_ns = time.perf_counter_ns()
+
+    def on_llm_end(self, response, **kwargs):
+        if self.start_ns is None:
+            return
+        end_ns = time.perf_counter_ns()
+        self.timings["llm_ms"] = round((end_ns - self.start_ns) / 1e6, 3)
+        if self.first_token_ns is None:
+            return
+        self.timings["ttft_ms"] = round((self.first_token_ns - self.start_ns) / 1e6, 3)
+
+        # Decode time spread over every token after the first.
+        try:
+            usage = response.generations[0][0].message.usage_metadata or {}
+        except (AttributeError, IndexError):
+            usage = {}
+        output_tokens = usage.get("output_tokens", 0)
+        if output_tokens > 1:
+            self.timings["tpot_ms"] = round((end_ns - self.first_token_ns) / 1e6 / (output_tokens - 1), 3)
+
+# --- Nodes ---
+
+def analyze_threat(state: AgentState):
+    """Plan the mitigation steps for the threat."""
+    path = state["file_path"]
+    threat = state["threat_type"]
+    logger.info(f"Analyzing threat: {threat} in {path}")
+    start = time.perf_counter_ns()
+
+    # The plan is fully determined by the threat: quarantine first, then report.
+    # Only the advice text may come from the LLM, and only when asked for.
+    advice = ADVICE_TABLE.get(threat, DEFAULT_ADVICE)
+    if state.get("llm_advice"):
+        try:
+            advice = generate_llm_advice(threat, path)
+        except Exception as e:
+            logger.error(f"LLM advice failed, using canned advice: {e}")
+
+    return {
+        "tool_calls": [
+            {"name": "quarantine_file", "args": {"file_path": path}},
+            {"name": "write_remediation_report",
+             "args": {"file_path": path, "threat_type": threat, "advice": advice}},
+        ],
+        "timings": {"analyze_ms": _ms_since(start)},
+    }
 
 def execute_mitigation(state: AgentState):
-    """Execute the tools chosen by the LLM."""
+    """Execute the planned mitigation tools."""
     results = []
+    tool_ms = {}
     for tool_call in state["tool_calls"]:
         tool_name = tool_call["name"]
         args = tool_call["args"]
@@ -64,10 +172,15 @@ def execute_mitigation(state: AgentState):
         tool_func = tools_map.get(tool_name)
 
         # Invoke tool
+        start = time.perf_counter_ns()
         res = tool_func.invoke(args)
+        tool_ms[tool_name] = _ms_since(start)
         results.append(str(res))
 
-    return {"analysis": f"Executed {len(results)} mitigation steps."}
+    return {
+        "analysis": f"Executed {len(results)} mitigation steps.",
+        "timings": {**state.get("timings", {}), "tool_ms": tool_ms},
+    }
 
 # --- Graph ---
 
@@ -83,22 +196,56 @@ def build_sentinel_agent():
 
     return workflow.compile()
 
-# --- Runner ---
+@lru_cache(maxsize=1)
+def get_app():
+    """Compiled graph, built on first use and shared by every event."""
+    return build_sentinel_agent()
 
-def process_threat_event(file_path: str, threat_type: str):
-    """Entry point for the CLI."""
-    langfuse_handler = CallbackHandler()
-    app = build_sentinel_agent()
+@lru_cache(maxsize=1)
+def get_langfuse_handler():
+    """Langfuse callback handler, created once per process."""
+    _load_env()
+    return CallbackHandler()
 
+# --- Runner ---
+
+def process_threat_event(file_path: str, threat_type: str, llm_advice: bool = False,
+                         scan_ms: float | None = None, queue_ms: float | None = None,
+                         arrived_ns: int | None = None):
+    """
+    Entry point for the CLI. `queue_ms` and `scan_ms` are the time the CLI spent
+    before and during detection, and `arrived_ns` is the perf_counter_ns() at
+    which the file event arrived; they are only used for the latency log line.
+    If the agent crashed, the result carries the message under "error".
+    """
     initial_state = {
         "file_path": file_path,
-        "threat_type": threat_type
+        "threat_type": threat_type,
+        "llm_advice": llm_advice,
+        "timings": {},
     }
+    latency = LatencyCallback()
+    start = time.perf_counter_ns()
 
     try:
         # We process it
-        result = app.invoke(initial_state, config={"callbacks": [langfuse_handler]})
-        return result
+        result = get_app().invoke(initial_state, config={"callbacks": [get_langfuse_handler(), latency]})
     except Exception as e:
         logger.error(f"Agent failed: {e}")
-        return {"analysis": f"Agent Crash: {str(e)}"}
+        result = {"analysis": f"Agent Crash: {str(e)}", "error": str(e)}
+
+    # One JSON line per event so runs can be diffed phase by phase.
+    graph_ms = _ms_since(start)
+    logger.info(json.dumps({
+        "event": "latency",
+        "file_path": file_path,
+        "threat_type": threat_type,
+        "queue_ms": queue_ms,
+        "scan_ms": scan_ms,
+        "graph_ms": graph_ms,
+        **result.get("timings", {}),
+        **latency.timings,
+        # End to end: file event to mitigation done, including agent pool waits.
+        "total_ms": _ms_since(start if arrived_ns is None else arrived_ns),
+    }))
+    return result
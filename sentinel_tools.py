@@ -1,4 +1,6 @@
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
 from langchain.tools import tool
 from rich.console import Console
@@ -8,6 +10,21 @@ console = Console()
 QUARANTINE_SUFFIX = ".__quarantined__"
 REMEDIATION_PREFIX = "REMEDIATION_"
 
+# Agent runs are concurrent; this keeps two of them from both appending the
+# rules block to the same .gitignore.
+_gitignore_lock = threading.Lock()
+
+@lru_cache(maxsize=256)
+def find_git_root(directory: Path) -> Path:
+    """
+    Returns the closest ancestor of `directory` (inclusive) containing a .git
+    entry, or `directory` itself when it is not inside a repository.
+    """
+    for candidate in (directory, *directory.parents):
+        if (candidate / ".git").exists():
+            return candidate
+    return directory
+
 @tool
 def quarantine_file(file_path: str):
     """
@@ -15,34 +32,36 @@ def quarantine_file(file_path: str):
     Use this immediately when a threat is detected.
     """
     path = Path(file_path)
-    if not path.exists():
-        return "File not found."
 
     # 1. Rename the file (The "Lock")
+    # os.replace is atomic and doubles as the existence check.
     quarantined_path = path.with_name(f"{path.name}{QUARANTINE_SUFFIX}")
     try:
-        os.rename(path, quarantined_path)
+        os.replace(path, quarantined_path)
         console.print(f"[bold red]🛡️  TOOL EXECUTION: File quarantined to {quarantined_path.name}[/bold red]")
+    except FileNotFoundError:
+        return "File not found."
     except OSError as e:
         return f"Failed to move file: {e}"
 
     # 2. Patch .gitignore (The "Seal")
     # We walk up to find the root .gitignore
-    gitignore_path = path.parent / ".gitignore"
-    
+    gitignore_path = find_git_root(path.parent) / ".gitignore"
+
     rules = [f"*{QUARANTINE_SUFFIX}", f"{REMEDIATION_PREFIX}*.md"]
-    current_content = ""
-    
-    if gitignore_path.exists():
-        current_content = gitignore_path.read_text()
-    
-    missing_rules = [r for r in rules if r not in current_content]
-    
-    if missing_rules:
-        with open(gitignore_path, "a") as f:
+
+    # One open for both the read and the append; "a+" creates the file if needed.
+    with _gitignore_lock, open(gitignore_path, "a+") as f:
+        f.seek(0)
+        current_content = f.read()
+        missing_rules = [r for r in rules if r not in current_content]
+
+        if missing_rules:
             f.write("\n\n# --- SECURITY SENTINEL RULES ---\n")
             for rule in missing_rules:
                 f.write(f"{rule}\n")
+
+    if missing_rules:
         console.print("[bold yellow]🛠️  TOOL EXECUTION: .gitignore patched to hide quarantined files.[/bold yellow]")
 
     return f"File quarantined and .gitignore updated."